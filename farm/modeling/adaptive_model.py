@@ -421,13 +421,26 @@ class AdaptiveModel(nn.Module, BaseAdaptiveModel):
         except:
             extraction_layer = -1
 
+        # LMs with an extra pooler (e.g. DistilBert) can skip it, if no prediction head needs the pooled output
+        if "return_pooled" not in kwargs:
+            kwargs["return_pooled"] = len(self.prediction_heads) == 0 or any(
+                lm_out in ("per_sequence", "per_sequence_continuous") for lm_out in self.lm_output_types
+            )
+
+        # Optionally skip the columns of the batch that are padding for all sequences, see
+        # LanguageModel.enable_padding_trimming()
+        if self.language_model.trims_padding:
+            lm_forward = self.language_model.forward_trimmed
+        else:
+            lm_forward = self.language_model
+
         # Run forward pass of language model
         if extraction_layer == -1:
-            sequence_output, pooled_output = self.language_model(**kwargs, output_all_encoded_layers=False)
+            sequence_output, pooled_output = lm_forward(**kwargs, output_all_encoded_layers=False)
         else:
             # get output from an earlier layer
             self.language_model.enable_hidden_states_output()
-            sequence_output, pooled_output, all_hidden_states = self.language_model(**kwargs)
+            sequence_output, pooled_output, all_hidden_states = lm_forward(**kwargs)
             sequence_output = all_hidden_states[extraction_layer]
             pooled_output = None #not available in earlier layers
             self.language_model.disable_hidden_states_output()
@@ -459,12 +472,21 @@ class AdaptiveModel(nn.Module, BaseAdaptiveModel):
         msg = f"Vocab size of tokenizer {vocab_size} doesn't match with model {model_vocab_len}. " \
               "If you added a custom vocabulary to the tokenizer, " \
               "make sure to supply 'n_added_tokens' to LanguageModel.load() and BertStyleLM.load()"
-        assert vocab_size == model_vocab_len, msg
+        # The LM embeddings might have been padded via LanguageModel.load(pad_vocab_to_multiple_of=...)
+        pad_to = getattr(self.language_model.model.config, "pad_vocab_to_multiple_of", None)
+        if pad_to:
+            assert -(-vocab_size // pad_to) * pad_to == model_vocab_len, msg
+        else:
+            assert vocab_size == model_vocab_len, msg
 
         for head in self.prediction_heads:
             if head.model_type == "language_modelling":
                 ph_decoder_len = head.decoder.weight.shape[0]
-                assert vocab_size == ph_decoder_len, msg
+                assert vocab_size == head.vocab_size and model_vocab_len == ph_decoder_len, msg
+                assert getattr(head, "pad_vocab_to_multiple_of", None) == pad_to, \
+                    f"The embeddings of the LM are padded to a multiple of {pad_to}, but the LM head to a multiple " \
+                    f"of {getattr(head, 'pad_vocab_to_multiple_of', None)}. Make sure to supply the same " \
+                    f"'pad_vocab_to_multiple_of' to LanguageModel.load() and BertLMHead.load()"
 
     def get_language(self):
         return self.language_model.language
@@ -496,6 +518,12 @@ class AdaptiveModel(nn.Module, BaseAdaptiveModel):
             ph_state_dict["transform.dense.bias"] = ph_state_dict.pop("dense.bias")
             ph_state_dict["transform.LayerNorm.weight"] = ph_state_dict.pop("LayerNorm.weight")
             ph_state_dict["transform.LayerNorm.bias"] = ph_state_dict.pop("LayerNorm.bias")
+            # the bias of transformers' LM head also covers the padding rows of the vocab (if padded)
+            n_padding_rows = ph_state_dict["decoder.weight"].shape[0] - ph_state_dict["bias"].shape[0]
+            if n_padding_rows > 0:
+                # large negative bias, so that the padding tokens are never predicted
+                ph_state_dict["bias"] = torch.cat([ph_state_dict["bias"],
+                                                   ph_state_dict["bias"].new_full((n_padding_rows,), -10000.0)])
             transformers_model.cls.predictions.load_state_dict(ph_state_dict)
             logger.warning("Currently only the Masked Language Modeling component of the prediction head is converted, "
                            "not the Next Sentence Prediction or Sentence Order Prediction components")
@@ -21,26 +21,160 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import json
 import logging
 import os
+import re
+import sys
+import threading
+import types
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import lru_cache, wraps
 from pathlib import Path
 
-import numpy as np
 import torch
 from torch import nn
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
-from transformers.modeling_bert import BertModel, BertConfig
-from transformers.modeling_roberta import RobertaModel, RobertaConfig
-from transformers.modeling_xlnet import XLNetModel, XLNetConfig
-from transformers.modeling_albert import AlbertModel, AlbertConfig
-from transformers.modeling_xlm_roberta import XLMRobertaModel, XLMRobertaConfig
-from transformers.modeling_distilbert import DistilBertModel, DistilBertConfig
-from transformers.modeling_utils import SequenceSummary
+# Note: The model implementations of transformers are imported in the load() / from_scratch() methods of the
+# respective subclass, so that only the backend that is actually used gets imported.
+
+# torch.inference_mode (torch>=1.9) skips even more autograd bookkeeping than torch.no_grad
+_inference_mode = getattr(torch, "inference_mode", torch.no_grad)
 
 # These are the names of the attributes in various model configs which refer to the number of dimensions
 # in the output vectors
 OUTPUT_DIM_NAMES = ["dim", "hidden_size", "d_model"]
 
+# Used to infer the LanguageModel class from the (lower-cased) name of a Transformers' model.
+# Each entry maps tags (all of which must be contained in the name) to a class name. The order defines the precedence:
+# the first matching entry wins, e.g. "albert" and "distilbert" have to be checked before "bert".
+_TAG_TO_CLASS = (
+    (("xlm", "roberta"), "XLMRoberta"),
+    (("roberta",), "Roberta"),
+    (("albert",), "Albert"),
+    (("distilbert",), "DistilBert"),
+    (("bert",), "Bert"),
+    (("xlnet",), "XLNet"),
+)
+
+# Languages that can be inferred from the name of a language model
+_LANG_RE = re.compile(r"(german|english|chinese|indian|french|polish|spanish|multilingual)")
+
+
+@lru_cache(maxsize=64)
+def _resolve_class(path_str):
+    """ Infer the name of the LanguageModel class from a model name or path. Returns None if no class matches."""
+    # only the last path component is lower-cased, so that capitalized parent directories (e.g. "/home/Albert/")
+    # don't compete with the model name
+    parent, sep, name = path_str.replace("\\", "/").rstrip("/").rpartition("/")
+    lower = parent + sep + name.lower()
+    return next((class_name for tags, class_name in _TAG_TO_CLASS if all(tag in lower for tag in tags)), None)
+
+
+def _prefetch_file(path, n_threads=4, block_size=16 * 1024 * 1024):
+    """
+    Warm up the OS page cache for a (large) file by reading it with several threads in parallel.
+    A subsequent single-threaded read of the file (e.g. torch.load() of a checkpoint) is then served from memory
+    instead of the disk. Enabled for loading FARM checkpoints via the env variable FARM_PREFETCH_LOAD=1.
+
+    :param path: Path of the file to prefetch
+    :param n_threads: Number of threads reading disjoint parts of the file
+    :param block_size: Number of bytes read per call
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return
+    chunk_size = -(-size // n_threads)
+
+    def _read_range(offset):
+        end = min(offset + chunk_size, size)
+        buffer = memoryview(bytearray(min(block_size, chunk_size)))
+        with open(path, "rb", buffering=0) as f:
+            f.seek(offset)
+            while offset < end:
+                n_read = f.readinto(buffer[:min(block_size, end - offset)])
+                if not n_read:
+                    break
+                offset += n_read
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        list(executor.map(_read_range, range(0, size, chunk_size)))
+
+
+def _fadvise_willneed(path):
+    """
+    Ask the OS to read a file into the page cache in the background. On platforms without posix_fadvise,
+    the file is read via _prefetch_file() instead. Paths that are not a file (e.g. remote models) are skipped.
+    """
+    if not os.path.isfile(path):
+        return
+    if hasattr(os, "posix_fadvise"):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    else:
+        _prefetch_file(path)
+
+
+def _apply_to_tensors(outputs, fn):
+    """ Apply fn to all tensors in (nested tuples of) outputs of a forward pass."""
+    if isinstance(outputs, tuple):
+        return tuple(_apply_to_tensors(output, fn) for output in outputs)
+    return fn(outputs) if torch.is_tensor(outputs) else outputs
+
+
+# Inputs of LanguageModel.forward() that determine its outputs, used as key for the forward cache
+_FORWARD_CACHE_INPUTS = ("input_ids", "segment_ids", "padding_mask")
+# Guards the forward caches: replicas of a model wrapped in DataParallel share its cache and run in parallel threads.
+# Module-level, so that models with an enabled cache can still be copied and pickled.
+_FORWARD_CACHE_LOCK = threading.Lock()
+
+
+def _with_forward_cache(forward):
+    """
+    Decorator for the forward() of LanguageModels: serves repeated inputs from the cache enabled via
+    LanguageModel.enable_forward_cache(). The cache is only used in eval mode and with disabled gradients.
+    Lookups and updates hold _FORWARD_CACHE_LOCK, the forward pass itself runs outside of it.
+    """
+    @wraps(forward)
+    def forward_with_cache(self, *args, **kwargs):
+        if self._forward_cache is None or self.training or torch.is_grad_enabled():
+            return forward(self, *args, **kwargs)
+        inputs = list(args) + [kwargs.get(name) for name in _FORWARD_CACHE_INPUTS]
+        key = (self._emit_hidden, self._autocast_dtype, kwargs.get("return_pooled", True)) + tuple(
+            (tuple(tensor.shape), str(tensor.dtype), tensor.detach().cpu().numpy().tobytes())
+            for tensor in inputs if torch.is_tensor(tensor)
+        )
+        device = next((tensor.device for tensor in inputs if torch.is_tensor(tensor)), None)
+        # Cached outputs never share storage with returned ones (.to() / .cpu() are no-ops for CPU tensors),
+        # so that in-place changes by the caller don't corrupt the cache.
+        with _FORWARD_CACHE_LOCK:
+            cached_outputs = self._forward_cache.get(key)
+            if cached_outputs is not None:
+                self._forward_cache.move_to_end(key)
+        if cached_outputs is not None:
+            return _apply_to_tensors(cached_outputs, lambda t: t.to(device, copy=True))
+        outputs = forward(self, *args, **kwargs)
+        # keep the cached outputs in host memory, GPU memory is better spent on the model & batches
+        cpu_outputs = _apply_to_tensors(outputs, lambda t: t.detach().to("cpu", copy=True))
+        with _FORWARD_CACHE_LOCK:
+            self._forward_cache[key] = cpu_outputs
+            while len(self._forward_cache) > self._forward_cache_capacity:
+                self._forward_cache.popitem(last=False)
+        return outputs
+
+    return forward_with_cache
+
+
 class LanguageModel(nn.Module):
     """
     The parent class for any kind of model that can embed language into a semantic vector space. Practically
@@ -49,25 +183,36 @@ class LanguageModel(nn.Module):
     """
 
     subclasses = {}
+    # dtype for mixed precision in the forward pass, see set_precision()
+    _autocast_dtype = None
+    # Whether the AdaptiveModel runs the LM via forward_trimmed(), see enable_padding_trimming()
+    _trim_padding = False
+    # Whether forward() also returns all hidden states. Mirrors the flag of the wrapped model, which is only
+    # changed via enable_/disable_hidden_states_output(), so that forward doesn't need to look it up on every call.
+    _emit_hidden = False
+    # LRU cache of forward() outputs, see enable_forward_cache()
+    _forward_cache = None
+    _forward_cache_capacity = 0
 
     def __init_subclass__(cls, **kwargs):
         """ This automatically keeps track of all available subclasses.
         Enables generic load() or all specific LanguageModel implementation.
         """
         super().__init_subclass__(**kwargs)
-        cls.subclasses[cls.__name__] = cls
+        cls.subclasses[sys.intern(cls.__name__)] = cls
 
     def forward(self, input_ids, padding_mask, **kwargs):
         raise NotImplementedError
 
     @classmethod
-    def from_scratch(cls, model_type, vocab_size):
+    def from_scratch(cls, model_type, vocab_size, dtype=None):
         if model_type.lower() == "bert":
             model = Bert
-        return model.from_scratch(vocab_size)
+        return model.from_scratch(vocab_size, dtype=dtype)
 
     @classmethod
-    def load(cls, pretrained_model_name_or_path, n_added_tokens=0, language_model_class=None, **kwargs):
+    def load(cls, pretrained_model_name_or_path, n_added_tokens=0, language_model_class=None,
+             pad_vocab_to_multiple_of=None, **kwargs):
         """
         Load a pretrained language model either by
 
@@ -104,32 +249,44 @@ class LanguageModel(nn.Module):
         :type pretrained_model_name_or_path: str
         :param language_model_class: (Optional) Name of the language model class to load (e.g. `Bert`)
         :type language_model_class: str
+        :param pad_vocab_to_multiple_of: (Optional) Resize the embeddings (incl. `n_added_tokens`), so that the
+                                         vocab size is rounded up to a multiple of this number (e.g. 8 for Tensor
+                                         Cores on fp16). This speeds up the vocab-sized output matmul of a
+                                         BertLMHead sharing the embedding weights, which needs the same
+                                         `pad_vocab_to_multiple_of` in BertLMHead.load(). The extra rows are never
+                                         indexed by the tokenizer and never predicted by the head.
+        :type pad_vocab_to_multiple_of: int
+        :param dtype: (Optional) torch.dtype the weights are cast to after loading (e.g. torch.float16).
+                      By default, the weights are kept in the dtype of the loaded model.
+        :type dtype: torch.dtype
 
         """
+        # cast only at the very end, because resizing the embeddings creates them in the default dtype
+        dtype = kwargs.pop("dtype", None)
         config_file = Path(pretrained_model_name_or_path) / "language_model_config.json"
         if os.path.exists(config_file):
             # it's a local directory in FARM format
-            config = json.load(open(config_file))
-            language_model = cls.subclasses[config["name"]].load(pretrained_model_name_or_path)
+            with open(config_file, "rb") as f:
+                config_bytes = f.read()
+            config = None
+            if ORJSON_AVAILABLE:
+                try:
+                    config = orjson.loads(config_bytes)
+                except orjson.JSONDecodeError:
+                    # e.g. NaN / Infinity, which are written by json but rejected by orjson
+                    pass
+            if config is None:
+                config = json.loads(config_bytes)
+            language_model = cls._DISPATCH[sys.intern(config["name"])].load(pretrained_model_name_or_path)
         else:
             if language_model_class is None:
                 # it's transformers format (either from model hub or local)
                 pretrained_model_name_or_path = str(pretrained_model_name_or_path)
-                if "xlm" in pretrained_model_name_or_path and "roberta" in pretrained_model_name_or_path:
-                    language_model_class = 'XLMRoberta'
-                elif 'roberta' in pretrained_model_name_or_path:
-                    language_model_class = 'Roberta'
-                elif 'albert' in pretrained_model_name_or_path:
-                    language_model_class = 'Albert'
-                elif 'distilbert' in pretrained_model_name_or_path:
-                    language_model_class = 'DistilBert'
-                elif 'bert' in pretrained_model_name_or_path:
-                    language_model_class = 'Bert'
-                elif 'xlnet' in pretrained_model_name_or_path:
-                    language_model_class = 'XLNet'
+                language_model_class = _resolve_class(pretrained_model_name_or_path)
 
             if language_model_class:
-                language_model = cls.subclasses[language_model_class].load(pretrained_model_name_or_path, **kwargs)
+                language_model_class = sys.intern(language_model_class)
+                language_model = cls._DISPATCH[language_model_class].load(pretrained_model_name_or_path, **kwargs)
             else:
                 language_model = None
 
@@ -146,28 +303,196 @@ class LanguageModel(nn.Module):
                 f"https://farm.deepset.ai/api/modeling.html#farm.modeling.language_model.LanguageModel.load"
             )
 
-        # resize embeddings in case of custom vocab
-        if n_added_tokens != 0:
+        # resize embeddings in case of custom vocab (or to pad them)
+        if n_added_tokens != 0 or pad_vocab_to_multiple_of:
             # TODO verify for other models than BERT
-            model_emb_size = language_model.model.resize_token_embeddings(new_num_tokens=None).num_embeddings
+            model_emb_size = language_model.model.get_input_embeddings().weight.shape[0]
             vocab_size = model_emb_size + n_added_tokens
-            logger.info(
-                f"Resizing embedding layer of LM from {model_emb_size} to {vocab_size} to cope with custom vocab.")
-            language_model.model.resize_token_embeddings(vocab_size)
-            # verify
-            model_emb_size = language_model.model.resize_token_embeddings(new_num_tokens=None).num_embeddings
-            assert vocab_size == model_emb_size
+            if n_added_tokens != 0:
+                logger.info(
+                    f"Resizing embedding layer of LM from {model_emb_size} to {vocab_size} to cope with custom vocab.")
+            if pad_vocab_to_multiple_of:
+                padded_vocab_size = -(-vocab_size // pad_vocab_to_multiple_of) * pad_vocab_to_multiple_of
+                logger.info(
+                    f"Padding embedding layer of LM from {vocab_size} to {padded_vocab_size} "
+                    f"(multiple of {pad_vocab_to_multiple_of}).")
+                vocab_size = padded_vocab_size
+                # stored in the config so that the padding is known again after saving & loading the model
+                language_model.model.config.pad_vocab_to_multiple_of = pad_vocab_to_multiple_of
+            if vocab_size != model_emb_size:
+                language_model.model.resize_token_embeddings(vocab_size)
+                # verify
+                model_emb_size = language_model.model.get_input_embeddings().weight.shape[0]
+                assert vocab_size == model_emb_size
+
+        if dtype is not None:
+            language_model.to(dtype)
 
         return language_model
 
+    @classmethod
+    def prefetch(cls, paths, n_threads=4):
+        """
+        Warm up the OS page cache for the weights of FARM language models that will be loaded later on,
+        e.g. when loading several models one after another. The weights are read in background threads, so that
+        the following LanguageModel.load() calls are served from memory instead of the disk.
+
+        :param paths: Directories of language models saved in FARM format
+        :type paths: list
+        :param n_threads: Number of background threads
+        :type n_threads: int
+        :return: One concurrent.futures.Future per path, completing once its prefetch is done
+        """
+        executor = ThreadPoolExecutor(max_workers=n_threads)
+        futures = [executor.submit(_fadvise_willneed, Path(path) / "language_model.bin") for path in paths]
+        # don't block, the threads are released once all prefetches are done
+        executor.shutdown(wait=False)
+        return futures
+
     def get_output_dims(self):
+        # the output dims don't change for a given model, so we only look them up once
+        output_dims = getattr(self, "_output_dims", None)
+        if output_dims is not None:
+            return output_dims
         config = self.model.config
         for odn in OUTPUT_DIM_NAMES:
-            if odn in dir(config):
-                return getattr(config, odn)
+            if hasattr(config, odn):
+                self._output_dims = getattr(config, odn)
+                return self._output_dims
         else:
             raise Exception("Could not infer the output dimensions of the language model")
 
+    def enable_jit(self, mode="reduce-overhead", dynamic=True):
+        """
+        Compile the wrapped transformers model (and the extra pooler of DistilBert / XLNet as a single graph)
+        via torch.compile to speed up the forward pass through kernel fusion and less Python overhead.
+        Meant for inference.
+        The modules are compiled in place, so their state_dict and `save()` are not affected.
+        Requires torch>=2.2, for older versions a warning is logged and the model stays as it is.
+
+        :param mode: Compilation mode of torch.compile (e.g. "default", "reduce-overhead", "max-autotune")
+        :type mode: str
+        :param dynamic: Whether to compile for dynamic shapes, i.e. varying batch sizes and sequence lengths
+        :type dynamic: bool
+        """
+        if not hasattr(nn.Module, "compile"):
+            logger.warning(f"Compiling the language model requires torch>=2.2, but found {torch.__version__}. "
+                           f"Continuing without compilation.")
+            return
+        self.model.compile(mode=mode, dynamic=dynamic)
+        if getattr(self, "pooler", None) is not None:
+            # The SequenceSummary pooler only branches on attributes fixed at init. Compiling it as one full graph
+            # fuses slicing, dense layer and activation instead of launching them one by one.
+            self.pooler.compile(mode=mode, dynamic=dynamic, fullgraph=True)
+
+    def forward_trimmed(self, **kwargs):
+        """
+        Forward pass on the batch without the columns that are padding for all of its sequences, i.e. only on the
+        span of the longest sequence in the batch. This saves computation proportional to the removed padding.
+        Afterwards, the sequence output and hidden states are padded back with zeros to the original input length,
+        so callers get the usual shapes. Note: The outputs at the padding positions are therefore zeros.
+
+        :param kwargs: The same arguments as for forward(). All tensors of shape [batch_size, max_seq_len]
+                       (like input_ids, segment_ids, padding_mask) are trimmed.
+        :return: Same as forward()
+        """
+        # the span is data dependent and would end up as constants in a trace (e.g. for the ONNX export)
+        if torch.jit.is_tracing():
+            return self(**kwargs)
+        padding_mask = kwargs["padding_mask"]
+        max_seq_len = padding_mask.shape[1]
+        used_columns = padding_mask.ne(0).any(dim=0).nonzero()
+        if used_columns.numel() == 0:
+            return self(**kwargs)
+        # sequences are padded either on the right (most models) or on the left (XLNet)
+        start, end = int(used_columns[0]), int(used_columns[-1]) + 1
+        if end - start == max_seq_len:
+            return self(**kwargs)
+
+        trimmed_kwargs = {
+            name: value[:, start:end] if torch.is_tensor(value) and value.shape == padding_mask.shape else value
+            for name, value in kwargs.items()
+        }
+        outputs = self(**trimmed_kwargs)
+
+        def _pad_back(sequence):
+            return nn.functional.pad(sequence, (0, 0, start, max_seq_len - end))
+
+        sequence_output, pooled_output = _pad_back(outputs[0]), outputs[1]
+        if len(outputs) > 2:
+            all_hidden_states = tuple(_pad_back(hidden_states) for hidden_states in outputs[2])
+            return sequence_output, pooled_output, all_hidden_states
+        return sequence_output, pooled_output
+
+    def enable_padding_trimming(self):
+        """
+        Let the AdaptiveModel run the language model via forward_trimmed(), i.e. only on the span of the longest
+        sequence in each batch. This speeds up batches with a lot of padding (e.g. inference with a large
+        max_seq_len). Note: The outputs at the padding positions become zeros instead of the model's outputs
+        for the padding tokens. While tracing (e.g. in AdaptiveModel.convert_to_onnx()), the full batch is used.
+        """
+        self._trim_padding = True
+
+    def disable_padding_trimming(self):
+        self._trim_padding = False
+
+    @property
+    def trims_padding(self):
+        """ Whether padding trimming is enabled, see enable_padding_trimming()."""
+        return self._trim_padding
+
+    def set_precision(self, dtype):
+        """
+        Run the forward pass in mixed precision via torch.autocast, e.g. with torch.float16 or torch.bfloat16 on GPU.
+        The weights stay as they are (usually float32) and the outputs are cast back to float32 for the prediction
+        heads. To cast the weights themselves (e.g. for fp16 inference), use `.half()` / `.bfloat16()` instead.
+        Requires torch>=1.10.
+
+        :param dtype: The dtype for autocast or None to disable mixed precision again.
+        :type dtype: torch.dtype
+        """
+        if dtype is not None and not hasattr(torch, "autocast"):
+            raise ValueError(f"Mixed precision via set_precision() requires torch>=1.10, but found {torch.__version__}.")
+        self._autocast_dtype = dtype
+
+    def _autocast(self, device_type):
+        """ Context for the forward pass: autocast to the dtype set via set_precision(), a no-op otherwise."""
+        if self._autocast_dtype is None:
+            return ExitStack()
+        return torch.autocast(device_type=device_type, dtype=self._autocast_dtype)
+
+    def _autocast_outputs_to_fp32(self, outputs):
+        """ Cast (nested tuples of) tensors computed under autocast back to float32."""
+        if self._autocast_dtype is None:
+            return outputs
+        return _apply_to_tensors(outputs, lambda tensor: tensor.float())
+
+    def enable_forward_cache(self, capacity=128):
+        """
+        Cache the outputs of forward() for the last `capacity` distinct batches, so that repeated batches
+        (e.g. evaluating the same data several times) skip the language model. The cache is used only in eval mode
+        with disabled gradients, keeps the outputs in host memory and is cleared whenever the model is set back to
+        training mode via `train()`. Call `disable_forward_cache()` to free it, e.g. after changing the weights
+        without `train()`.
+        With DataParallel, all replicas share this one cache. Access to it is serialized via a lock, but a batch
+        that misses the cache in several replicas at the same time is computed by each of them.
+
+        :param capacity: Maximum number of cached batches. Each entry holds the full outputs of one batch.
+        :type capacity: int
+        """
+        self._forward_cache = OrderedDict()
+        self._forward_cache_capacity = capacity
+
+    def disable_forward_cache(self):
+        self._forward_cache = None
+
+    def train(self, mode=True):
+        # cached outputs get stale with the next training steps
+        if mode and self._forward_cache:
+            with _FORWARD_CACHE_LOCK:
+                self._forward_cache.clear()
+        return super().train(mode)
+
     def freeze(self, layers):
         """ To be implemented"""
         raise NotImplementedError()
@@ -196,7 +521,9 @@ class LanguageModel(nn.Module):
         model_to_save = (
             self.model.module if hasattr(self.model, "module") else self.model
         )  # Only save the model it-self
-        torch.save(model_to_save.state_dict(), save_name)
+        # a large write buffer avoids many small writes while the state_dict gets serialized
+        with open(save_name, "wb", buffering=64 * 1024 * 1024) as f:
+            torch.save(model_to_save.state_dict(), f)
         self.save_config(save_dir)
 
     @classmethod
@@ -208,17 +535,9 @@ class LanguageModel(nn.Module):
 
     @classmethod
     def _infer_language_from_name(cls, name):
-        known_languages = (
-            "german",
-            "english",
-            "chinese",
-            "indian",
-            "french",
-            "polish",
-            "spanish",
-            "multilingual",
-        )
-        matches = [lang for lang in known_languages if lang in name]
+        # unique matches in order of appearance. Case-sensitive on purpose, so that e.g. a capitalized parent
+        # directory ("/models/English/bert-base-german-cased") doesn't compete with the model name.
+        matches = list(dict.fromkeys(_LANG_RE.findall(str(name))))
         if len(matches) == 0:
             language = "english"
             logger.warning(
@@ -240,6 +559,7 @@ class LanguageModel(nn.Module):
 
         return language
 
+    @_inference_mode()
     def formatted_preds(self, logits, samples, ignore_first_token=True,
                         padding_mask=None, **kwargs):
         """
@@ -264,22 +584,22 @@ class LanguageModel(nn.Module):
                              "Make sure to set both, e.g. via Inferencer(extraction_strategy='cls_token', extraction_layer=-1)`")
 
         # unpack the tuple from LM forward pass
-        sequence_output = logits[0][0]
-        pooled_output = logits[0][1]
+        sequence_output, pooled_output = logits[0][0], logits[0][1]
 
         # aggregate vectors
+        # Except for "per_token", we select / pool on the device of the LM output first,
+        # so that only one vector per sample needs to be copied to host memory.
         if self.extraction_strategy == "pooled":
             if self.extraction_layer != -1:
                 raise ValueError(f"Pooled output only works for the last layer, but got extraction_layer = {self.extraction_layer}. Please set `extraction_layer=-1`.)")
             vecs = pooled_output.cpu().numpy()
         elif self.extraction_strategy == "per_token":
+            # needs the full sequence output of shape [batch_size, max_seq_len, hidden_dim] on host
             vecs = sequence_output.cpu().numpy()
-        elif self.extraction_strategy == "reduce_mean":
-            vecs = self._pool_tokens(sequence_output, padding_mask, self.extraction_strategy, ignore_first_token=ignore_first_token)
-        elif self.extraction_strategy == "reduce_max":
+        elif self.extraction_strategy in ("reduce_mean", "reduce_max"):
             vecs = self._pool_tokens(sequence_output, padding_mask, self.extraction_strategy, ignore_first_token=ignore_first_token)
         elif self.extraction_strategy == "cls_token":
-            vecs = sequence_output[:, 0, :].cpu().numpy()
+            vecs = sequence_output.select(1, 0).cpu().numpy()
         else:
             raise NotImplementedError
 
@@ -291,25 +611,82 @@ class LanguageModel(nn.Module):
             preds.append(pred)
         return preds
 
+    @_inference_mode()
     def _pool_tokens(self, sequence_output, padding_mask, strategy, ignore_first_token):
-
-        token_vecs = sequence_output.cpu().numpy()
         # we only take the aggregated value of non-padding tokens
-        padding_mask = padding_mask.cpu().numpy()
-        ignore_mask_2d = padding_mask == 0
+        # (reduce on the device of sequence_output and only copy the pooled vectors to host memory)
+        token_mask = padding_mask.to(sequence_output.device) != 0
         # sometimes we want to exclude the CLS token as well from our aggregation operation
         if ignore_first_token:
-            ignore_mask_2d[:, 0] = True
-        ignore_mask_3d = np.zeros(token_vecs.shape, dtype=bool)
-        ignore_mask_3d[:, :, :] = ignore_mask_2d[:, :, np.newaxis]
+            token_mask[:, 0] = False
         if strategy == "reduce_max":
-            pooled_vecs = np.ma.array(data=token_vecs, mask=ignore_mask_3d).max(axis=1).data
+            pooled_vecs = sequence_output.masked_fill(~token_mask.unsqueeze(-1), float("-inf")).max(dim=1)[0]
+            # like for reduce_mean, sequences without any unmasked token are pooled to a zero vector (instead of -inf)
+            pooled_vecs = pooled_vecs.masked_fill(~token_mask.any(dim=1, keepdim=True), 0)
         if strategy == "reduce_mean":
-            pooled_vecs = np.ma.array(data=token_vecs, mask=ignore_mask_3d).mean(axis=1).data
-        return pooled_vecs
+            # sum of the unmasked tokens as batched matmul [batch, 1, seq_len] x [batch, seq_len, hidden],
+            # so that no masked copy of the whole sequence output needs to be allocated
+            token_weights = token_mask.to(sequence_output.dtype).unsqueeze(1)
+            pooled_vecs = torch.bmm(token_weights, sequence_output).squeeze(1) / token_weights.sum(dim=2).clamp(min=1)
+        return pooled_vecs.cpu().numpy()
+
+
+# Read-only view on all registered LanguageModel subclasses, which also reflects subclasses defined later on
+LanguageModel._DISPATCH = types.MappingProxyType(LanguageModel.subclasses)
+
+
+class _BertStyleLMMixin:
+    """
+    Shared forward pass and hidden states switch of language models whose transformers implementation
+    takes `token_type_ids` and returns a pooled output (Bert, Albert, Roberta, XLMRoberta).
+    """
+
+    @_with_forward_cache
+    def forward(
+        self,
+        input_ids,
+        segment_ids,
+        padding_mask,
+        **kwargs,
+    ):
+        """
+        Perform the forward pass of the wrapped transformers model.
 
+        :param input_ids: The ids of each token in the input sequence. Is a tensor of shape [batch_size, max_seq_len]
+        :type input_ids: torch.Tensor
+        :param segment_ids: The id of the segment. For example, in next sentence prediction, the tokens in the
+           first sentence are marked with 0 and those in the second are marked with 1.
+           It is a tensor of shape [batch_size, max_seq_len]
+        :type segment_ids: torch.Tensor
+        :param padding_mask: A mask that assigns a 1 to valid input tokens and 0 to padding tokens
+           of shape [batch_size, max_seq_len]
+        :return: Embeddings for each token in the input sequence.
 
-class Bert(LanguageModel):
+        """
+        with self._autocast(input_ids.device.type):
+            output_tuple = self.model(
+                input_ids,
+                token_type_ids=segment_ids,
+                attention_mask=padding_mask,
+            )
+        output_tuple = self._autocast_outputs_to_fp32(output_tuple)
+        if self._emit_hidden:
+            sequence_output, pooled_output, all_hidden_states = output_tuple[0], output_tuple[1], output_tuple[2]
+            return sequence_output, pooled_output, all_hidden_states
+        else:
+            sequence_output, pooled_output = output_tuple[0], output_tuple[1]
+            return sequence_output, pooled_output
+
+    def enable_hidden_states_output(self):
+        self.model.encoder.output_hidden_states = True
+        self._emit_hidden = True
+
+    def disable_hidden_states_output(self):
+        self.model.encoder.output_hidden_states = False
+        self._emit_hidden = False
+
+
+class Bert(_BertStyleLMMixin, LanguageModel):
     """
     A BERT model that wraps HuggingFace's implementation
     (https://github.com/huggingface/transformers) to fit the LanguageModel class.
@@ -323,12 +700,16 @@ class Bert(LanguageModel):
         self.name = "bert"
 
     @classmethod
-    def from_scratch(cls, vocab_size, name="bert", language="en"):
+    def from_scratch(cls, vocab_size, name="bert", language="en", dtype=None):
+        from transformers.modeling_bert import BertModel, BertConfig
+
         bert = cls()
         bert.name = name
         bert.language = language
         config = BertConfig(vocab_size=vocab_size)
         bert.model = BertModel(config)
+        if dtype is not None:
+            bert.model.to(dtype)
         return bert
 
     @classmethod
@@ -342,69 +723,40 @@ class Bert(LanguageModel):
 
         :param pretrained_model_name_or_path: The path of the saved pretrained model or its name.
         :type pretrained_model_name_or_path: str
+        :param dtype: (Optional) torch.dtype the weights are cast to after loading (e.g. torch.float16).
+                      By default, the weights are kept in the dtype of the loaded model.
+        :type dtype: torch.dtype
 
         """
+        from transformers.modeling_bert import BertModel, BertConfig
 
+        dtype = kwargs.pop("dtype", None)
         bert = cls()
         if "farm_lm_name" in kwargs:
             bert.name = kwargs["farm_lm_name"]
         else:
             bert.name = pretrained_model_name_or_path
         # We need to differentiate between loading model using FARM format and Pytorch-Transformers format
-        farm_lm_config = Path(pretrained_model_name_or_path) / "language_model_config.json"
-        if os.path.exists(farm_lm_config):
+        model_path = Path(pretrained_model_name_or_path)
+        farm_lm_config = model_path / "language_model_config.json"
+        if farm_lm_config.exists():
             # FARM style
             bert_config = BertConfig.from_pretrained(farm_lm_config)
-            farm_lm_model = Path(pretrained_model_name_or_path) / "language_model.bin"
+            farm_lm_model = model_path / "language_model.bin"
+            if os.getenv("FARM_PREFETCH_LOAD") == "1":
+                _prefetch_file(farm_lm_model)
             bert.model = BertModel.from_pretrained(farm_lm_model, config=bert_config, **kwargs)
             bert.language = bert.model.config.language
         else:
             # Pytorch-transformer Style
             bert.model = BertModel.from_pretrained(str(pretrained_model_name_or_path), **kwargs)
             bert.language = cls._get_or_infer_language_from_name(language, pretrained_model_name_or_path)
+        if dtype is not None:
+            bert.to(dtype)
         return bert
 
-    def forward(
-        self,
-        input_ids,
-        segment_ids,
-        padding_mask,
-        **kwargs,
-    ):
-        """
-        Perform the forward pass of the BERT model.
-
-        :param input_ids: The ids of each token in the input sequence. Is a tensor of shape [batch_size, max_seq_len]
-        :type input_ids: torch.Tensor
-        :param segment_ids: The id of the segment. For example, in next sentence prediction, the tokens in the
-           first sentence are marked with 0 and those in the second are marked with 1.
-           It is a tensor of shape [batch_size, max_seq_len]
-        :type segment_ids: torch.Tensor
-        :param padding_mask: A mask that assigns a 1 to valid input tokens and 0 to padding tokens
-           of shape [batch_size, max_seq_len]
-        :return: Embeddings for each token in the input sequence.
-
-        """
-        output_tuple = self.model(
-            input_ids,
-            token_type_ids=segment_ids,
-            attention_mask=padding_mask,
-        )
-        if self.model.encoder.output_hidden_states == True:
-            sequence_output, pooled_output, all_hidden_states = output_tuple[0], output_tuple[1], output_tuple[2]
-            return sequence_output, pooled_output, all_hidden_states
-        else:
-            sequence_output, pooled_output = output_tuple[0], output_tuple[1]
-            return sequence_output, pooled_output
-
-    def enable_hidden_states_output(self):
-        self.model.encoder.output_hidden_states = True
 
-    def disable_hidden_states_output(self):
-        self.model.encoder.output_hidden_states = False
-
-
-class Albert(LanguageModel):
+class Albert(_BertStyleLMMixin, LanguageModel):
     """
     An ALBERT model that wraps the HuggingFace's implementation
     (https://github.com/huggingface/transformers) to fit the LanguageModel class.
@@ -428,69 +780,40 @@ class Albert(LanguageModel):
         :param pretrained_model_name_or_path: name or path of a model
         :param language: (Optional) Name of language the model was trained for (e.g. "german").
                          If not supplied, FARM will try to infer it from the model name.
+        :param dtype: (Optional) torch.dtype the weights are cast to after loading (e.g. torch.float16).
+                      By default, the weights are kept in the dtype of the loaded model.
         :return: Language Model
 
         """
+        from transformers.modeling_albert import AlbertModel, AlbertConfig
+
+        dtype = kwargs.pop("dtype", None)
         albert = cls()
         if "farm_lm_name" in kwargs:
             albert.name = kwargs["farm_lm_name"]
         else:
             albert.name = pretrained_model_name_or_path
         # We need to differentiate between loading model using FARM format and Pytorch-Transformers format
-        farm_lm_config = Path(pretrained_model_name_or_path) / "language_model_config.json"
-        if os.path.exists(farm_lm_config):
+        model_path = Path(pretrained_model_name_or_path)
+        farm_lm_config = model_path / "language_model_config.json"
+        if farm_lm_config.exists():
             # FARM style
             config = AlbertConfig.from_pretrained(farm_lm_config)
-            farm_lm_model = Path(pretrained_model_name_or_path) / "language_model.bin"
+            farm_lm_model = model_path / "language_model.bin"
+            if os.getenv("FARM_PREFETCH_LOAD") == "1":
+                _prefetch_file(farm_lm_model)
             albert.model = AlbertModel.from_pretrained(farm_lm_model, config=config, **kwargs)
             albert.language = albert.model.config.language
         else:
             # Huggingface transformer Style
             albert.model = AlbertModel.from_pretrained(str(pretrained_model_name_or_path), **kwargs)
             albert.language = cls._get_or_infer_language_from_name(language, pretrained_model_name_or_path)
+        if dtype is not None:
+            albert.to(dtype)
         return albert
 
-    def forward(
-        self,
-        input_ids,
-        segment_ids,
-        padding_mask,
-        **kwargs,
-    ):
-        """
-        Perform the forward pass of the Albert model.
 
-        :param input_ids: The ids of each token in the input sequence. Is a tensor of shape [batch_size, max_seq_len]
-        :type input_ids: torch.Tensor
-        :param segment_ids: The id of the segment. For example, in next sentence prediction, the tokens in the
-           first sentence are marked with 0 and those in the second are marked with 1.
-           It is a tensor of shape [batch_size, max_seq_len]
-        :type segment_ids: torch.Tensor
-        :param padding_mask: A mask that assigns a 1 to valid input tokens and 0 to padding tokens
-           of shape [batch_size, max_seq_len]
-        :return: Embeddings for each token in the input sequence.
-
-        """
-        output_tuple = self.model(
-            input_ids,
-            token_type_ids=segment_ids,
-            attention_mask=padding_mask,
-        )
-        if self.model.encoder.output_hidden_states == True:
-            sequence_output, pooled_output, all_hidden_states = output_tuple[0], output_tuple[1], output_tuple[2]
-            return sequence_output, pooled_output, all_hidden_states
-        else:
-            sequence_output, pooled_output = output_tuple[0], output_tuple[1]
-            return sequence_output, pooled_output
-
-    def enable_hidden_states_output(self):
-        self.model.encoder.output_hidden_states = True
-
-    def disable_hidden_states_output(self):
-        self.model.encoder.output_hidden_states = False
-
-
-class Roberta(LanguageModel):
+class Roberta(_BertStyleLMMixin, LanguageModel):
     """
     A roberta model that wraps the HuggingFace's implementation
     (https://github.com/huggingface/transformers) to fit the LanguageModel class.
@@ -515,69 +838,40 @@ class Roberta(LanguageModel):
         :param pretrained_model_name_or_path: name or path of a model
         :param language: (Optional) Name of language the model was trained for (e.g. "german").
                          If not supplied, FARM will try to infer it from the model name.
+        :param dtype: (Optional) torch.dtype the weights are cast to after loading (e.g. torch.float16).
+                      By default, the weights are kept in the dtype of the loaded model.
         :return: Language Model
 
         """
+        from transformers.modeling_roberta import RobertaModel, RobertaConfig
+
+        dtype = kwargs.pop("dtype", None)
         roberta = cls()
         if "farm_lm_name" in kwargs:
             roberta.name = kwargs["farm_lm_name"]
         else:
             roberta.name = pretrained_model_name_or_path
         # We need to differentiate between loading model using FARM format and Pytorch-Transformers format
-        farm_lm_config = Path(pretrained_model_name_or_path) / "language_model_config.json"
-        if os.path.exists(farm_lm_config):
+        model_path = Path(pretrained_model_name_or_path)
+        farm_lm_config = model_path / "language_model_config.json"
+        if farm_lm_config.exists():
             # FARM style
             config = RobertaConfig.from_pretrained(farm_lm_config)
-            farm_lm_model = Path(pretrained_model_name_or_path) / "language_model.bin"
+            farm_lm_model = model_path / "language_model.bin"
+            if os.getenv("FARM_PREFETCH_LOAD") == "1":
+                _prefetch_file(farm_lm_model)
             roberta.model = RobertaModel.from_pretrained(farm_lm_model, config=config, **kwargs)
             roberta.language = roberta.model.config.language
         else:
             # Huggingface transformer Style
             roberta.model = RobertaModel.from_pretrained(str(pretrained_model_name_or_path), **kwargs)
             roberta.language = cls._get_or_infer_language_from_name(language, pretrained_model_name_or_path)
+        if dtype is not None:
+            roberta.to(dtype)
         return roberta
 
-    def forward(
-        self,
-        input_ids,
-        segment_ids,
-        padding_mask,
-        **kwargs,
-    ):
-        """
-        Perform the forward pass of the Roberta model.
-
-        :param input_ids: The ids of each token in the input sequence. Is a tensor of shape [batch_size, max_seq_len]
-        :type input_ids: torch.Tensor
-        :param segment_ids: The id of the segment. For example, in next sentence prediction, the tokens in the
-           first sentence are marked with 0 and those in the second are marked with 1.
-           It is a tensor of shape [batch_size, max_seq_len]
-        :type segment_ids: torch.Tensor
-        :param padding_mask: A mask that assigns a 1 to valid input tokens and 0 to padding tokens
-           of shape [batch_size, max_seq_len]
-        :return: Embeddings for each token in the input sequence.
 
-        """
-        output_tuple = self.model(
-            input_ids,
-            token_type_ids=segment_ids,
-            attention_mask=padding_mask,
-        )
-        if self.model.encoder.output_hidden_states == True:
-            sequence_output, pooled_output, all_hidden_states = output_tuple[0], output_tuple[1], output_tuple[2]
-            return sequence_output, pooled_output, all_hidden_states
-        else:
-            sequence_output, pooled_output = output_tuple[0], output_tuple[1]
-            return sequence_output, pooled_output
-
-    def enable_hidden_states_output(self):
-        self.model.encoder.output_hidden_states = True
-
-    def disable_hidden_states_output(self):
-        self.model.encoder.output_hidden_states = False
-
-
-class XLMRoberta(LanguageModel):
+class XLMRoberta(_BertStyleLMMixin, LanguageModel):
     """
     A roberta model that wraps the HuggingFace's implementation
     (https://github.com/huggingface/transformers) to fit the LanguageModel class.
@@ -602,67 +896,38 @@ class XLMRoberta(LanguageModel):
         :param pretrained_model_name_or_path: name or path of a model
         :param language: (Optional) Name of language the model was trained for (e.g. "german").
                          If not supplied, FARM will try to infer it from the model name.
+        :param dtype: (Optional) torch.dtype the weights are cast to after loading (e.g. torch.float16).
+                      By default, the weights are kept in the dtype of the loaded model.
         :return: Language Model
 
         """
+        from transformers.modeling_xlm_roberta import XLMRobertaModel, XLMRobertaConfig
+
+        dtype = kwargs.pop("dtype", None)
         xlm_roberta = cls()
         if "farm_lm_name" in kwargs:
             xlm_roberta.name = kwargs["farm_lm_name"]
         else:
             xlm_roberta.name = pretrained_model_name_or_path
         # We need to differentiate between loading model using FARM format and Pytorch-Transformers format
-        farm_lm_config = Path(pretrained_model_name_or_path) / "language_model_config.json"
-        if os.path.exists(farm_lm_config):
+        model_path = Path(pretrained_model_name_or_path)
+        farm_lm_config = model_path / "language_model_config.json"
+        if farm_lm_config.exists():
             # FARM style
             config = XLMRobertaConfig.from_pretrained(farm_lm_config)
-            farm_lm_model = Path(pretrained_model_name_or_path) / "language_model.bin"
+            farm_lm_model = model_path / "language_model.bin"
+            if os.getenv("FARM_PREFETCH_LOAD") == "1":
+                _prefetch_file(farm_lm_model)
             xlm_roberta.model = XLMRobertaModel.from_pretrained(farm_lm_model, config=config, **kwargs)
             xlm_roberta.language = xlm_roberta.model.config.language
         else:
             # Huggingface transformer Style
             xlm_roberta.model = XLMRobertaModel.from_pretrained(str(pretrained_model_name_or_path), **kwargs)
             xlm_roberta.language = cls._get_or_infer_language_from_name(language, pretrained_model_name_or_path)
+        if dtype is not None:
+            xlm_roberta.to(dtype)
         return xlm_roberta
 
-    def forward(
-        self,
-        input_ids,
-        segment_ids,
-        padding_mask,
-        **kwargs,
-    ):
-        """
-        Perform the forward pass of the XLMRoberta model.
-
-        :param input_ids: The ids of each token in the input sequence. Is a tensor of shape [batch_size, max_seq_len]
-        :type input_ids: torch.Tensor
-        :param segment_ids: The id of the segment. For example, in next sentence prediction, the tokens in the
-           first sentence are marked with 0 and those in the second are marked with 1.
-           It is a tensor of shape [batch_size, max_seq_len]
-        :type segment_ids: torch.Tensor
-        :param padding_mask: A mask that assigns a 1 to valid input tokens and 0 to padding tokens
-           of shape [batch_size, max_seq_len]
-        :return: Embeddings for each token in the input sequence.
-
-        """
-        output_tuple = self.model(
-            input_ids,
-            token_type_ids=segment_ids,
-            attention_mask=padding_mask,
-        )
-        if self.model.encoder.output_hidden_states == True:
-            sequence_output, pooled_output, all_hidden_states = output_tuple[0], output_tuple[1], output_tuple[2]
-            return sequence_output, pooled_output, all_hidden_states
-        else:
-            sequence_output, pooled_output = output_tuple[0], output_tuple[1]
-            return sequence_output, pooled_output
-
-    def enable_hidden_states_output(self):
-        self.model.encoder.output_hidden_states = True
-
-    def disable_hidden_states_output(self):
-        self.model.encoder.output_hidden_states = False
-
 
 class DistilBert(LanguageModel):
     """
@@ -695,20 +960,30 @@ class DistilBert(LanguageModel):
 
         :param pretrained_model_name_or_path: The path of the saved pretrained model or its name.
         :type pretrained_model_name_or_path: str
+        :param dtype: (Optional) torch.dtype the weights are cast to after loading (e.g. torch.float16).
+                      By default, the weights are kept in the dtype of the loaded model.
+        :type dtype: torch.dtype
 
         """
+        from transformers.modeling_albert import AlbertConfig
+        from transformers.modeling_distilbert import DistilBertModel
+        from transformers.modeling_utils import SequenceSummary
 
+        dtype = kwargs.pop("dtype", None)
         distilbert = cls()
         if "farm_lm_name" in kwargs:
             distilbert.name = kwargs["farm_lm_name"]
         else:
             distilbert.name = pretrained_model_name_or_path
         # We need to differentiate between loading model using FARM format and Pytorch-Transformers format
-        farm_lm_config = Path(pretrained_model_name_or_path) / "language_model_config.json"
-        if os.path.exists(farm_lm_config):
+        model_path = Path(pretrained_model_name_or_path)
+        farm_lm_config = model_path / "language_model_config.json"
+        if farm_lm_config.exists():
             # FARM style
             config = AlbertConfig.from_pretrained(farm_lm_config)
-            farm_lm_model = Path(pretrained_model_name_or_path) / "language_model.bin"
+            farm_lm_model = model_path / "language_model.bin"
+            if os.getenv("FARM_PREFETCH_LOAD") == "1":
+                _prefetch_file(farm_lm_model)
             distilbert.model = DistilBertModel.from_pretrained(farm_lm_model, config=config, **kwargs)
             distilbert.language = distilbert.model.config.language
         else:
@@ -726,12 +1001,16 @@ class DistilBert(LanguageModel):
         config.summary_activation = 'tanh'
         distilbert.pooler = SequenceSummary(config)
         distilbert.pooler.apply(distilbert.model._init_weights)
+        if dtype is not None:
+            distilbert.to(dtype)
         return distilbert
 
+    @_with_forward_cache
     def forward(
         self,
         input_ids,
         padding_mask,
+        return_pooled=True,
         **kwargs,
     ):
         """
@@ -741,27 +1020,36 @@ class DistilBert(LanguageModel):
         :type input_ids: torch.Tensor
         :param padding_mask: A mask that assigns a 1 to valid input tokens and 0 to padding tokens
            of shape [batch_size, max_seq_len]
+        :param return_pooled: Whether to run the extra pooler. If False, None is returned as pooled output.
+        :type return_pooled: bool
         :return: Embeddings for each token in the input sequence.
 
         """
-        output_tuple = self.model(
-            input_ids,
-            attention_mask=padding_mask,
-        )
-        # We need to manually aggregate that to get a pooled output (one vec per seq)
-        pooled_output = self.pooler(output_tuple[0])
-        if self.model.config.output_hidden_states == True:
+        with self._autocast(input_ids.device.type):
+            output_tuple = self.model(
+                input_ids,
+                attention_mask=padding_mask,
+            )
+            # We need to manually aggregate that to get a pooled output (one vec per seq)
+            pooled_output = self.pooler(output_tuple[0]) if return_pooled else None
+        output_tuple, pooled_output = self._autocast_outputs_to_fp32((output_tuple, pooled_output))
+        if self._emit_hidden:
             sequence_output, all_hidden_states = output_tuple[0], output_tuple[1]
-            return sequence_output, pooled_output
+            return sequence_output, pooled_output, all_hidden_states
         else:
             sequence_output = output_tuple[0]
             return sequence_output, pooled_output
 
     def enable_hidden_states_output(self):
+        # the transformer of DistilBERT reads the flag from the config only once at init
         self.model.config.output_hidden_states = True
+        self.model.transformer.output_hidden_states = True
+        self._emit_hidden = True
 
     def disable_hidden_states_output(self):
         self.model.config.output_hidden_states = False
+        self.model.transformer.output_hidden_states = False
+        self._emit_hidden = False
 
 
 class XLNet(LanguageModel):
@@ -789,20 +1077,29 @@ class XLNet(LanguageModel):
         :param pretrained_model_name_or_path: name or path of a model
         :param language: (Optional) Name of language the model was trained for (e.g. "german").
                          If not supplied, FARM will try to infer it from the model name.
+        :param dtype: (Optional) torch.dtype the weights are cast to after loading (e.g. torch.float16).
+                      By default, the weights are kept in the dtype of the loaded model.
         :return: Language Model
 
         """
+        from transformers.modeling_xlnet import XLNetModel, XLNetConfig
+        from transformers.modeling_utils import SequenceSummary
+
+        dtype = kwargs.pop("dtype", None)
         xlnet = cls()
         if "farm_lm_name" in kwargs:
             xlnet.name = kwargs["farm_lm_name"]
         else:
             xlnet.name = pretrained_model_name_or_path
         # We need to differentiate between loading model using FARM format and Pytorch-Transformers format
-        farm_lm_config = Path(pretrained_model_name_or_path) / "language_model_config.json"
-        if os.path.exists(farm_lm_config):
+        model_path = Path(pretrained_model_name_or_path)
+        farm_lm_config = model_path / "language_model_config.json"
+        if farm_lm_config.exists():
             # FARM style
             config = XLNetConfig.from_pretrained(farm_lm_config)
-            farm_lm_model = Path(pretrained_model_name_or_path) / "language_model.bin"
+            farm_lm_model = model_path / "language_model.bin"
+            if os.getenv("FARM_PREFETCH_LOAD") == "1":
+                _prefetch_file(farm_lm_model)
             xlnet.model = XLNetModel.from_pretrained(farm_lm_model, config=config, **kwargs)
             xlnet.language = xlnet.model.config.language
         else:
@@ -817,13 +1114,17 @@ class XLNet(LanguageModel):
         config.summary_last_dropout = 0
         xlnet.pooler = SequenceSummary(config)
         xlnet.pooler.apply(xlnet.model._init_weights)
+        if dtype is not None:
+            xlnet.to(dtype)
         return xlnet
 
+    @_with_forward_cache
     def forward(
         self,
         input_ids,
         segment_ids,
         padding_mask,
+        return_pooled=True,
         **kwargs,
     ):
         """
@@ -837,23 +1138,27 @@ class XLNet(LanguageModel):
         :type segment_ids: torch.Tensor
         :param padding_mask: A mask that assigns a 1 to valid input tokens and 0 to padding tokens
            of shape [batch_size, max_seq_len]
+        :param return_pooled: Whether to run the extra pooler. If False, None is returned as pooled output.
+        :type return_pooled: bool
         :return: Embeddings for each token in the input sequence.
         """
 
         # Note: XLNet has a couple of special input tensors for pretraining / text generation  (perm_mask, target_mapping ...)
         # We will need to implement them, if we wanna support LM adaptation
 
-        output_tuple = self.model(
-            input_ids,
-            token_type_ids=segment_ids,
-            attention_mask=padding_mask,
-        )
-        # XLNet also only returns the sequence_output (one vec per token)
-        # We need to manually aggregate that to get a pooled output (one vec per seq)
-        #TODO verify that this is really doing correct pooling
-        pooled_output = self.pooler(output_tuple[0])
+        with self._autocast(input_ids.device.type):
+            output_tuple = self.model(
+                input_ids,
+                token_type_ids=segment_ids,
+                attention_mask=padding_mask,
+            )
+            # XLNet also only returns the sequence_output (one vec per token)
+            # We need to manually aggregate that to get a pooled output (one vec per seq)
+            #TODO verify that this is really doing correct pooling
+            pooled_output = self.pooler(output_tuple[0]) if return_pooled else None
+        output_tuple, pooled_output = self._autocast_outputs_to_fp32((output_tuple, pooled_output))
 
-        if self.model.output_hidden_states == True:
+        if self._emit_hidden:
             sequence_output, all_hidden_states = output_tuple[0], output_tuple[1]
             return sequence_output, pooled_output, all_hidden_states
         else:
@@ -862,6 +1167,8 @@ class XLNet(LanguageModel):
 
     def enable_hidden_states_output(self):
         self.model.output_hidden_states = True
+        self._emit_hidden = True
 
     def disable_hidden_states_output(self):
         self.model.output_hidden_states = False
+        self._emit_hidden = False
@@ -1,16 +1,11 @@
-import itertools
 import json
 import logging
 import os
 import numpy as np
-import pandas as pd
-from scipy.special import expit, softmax
-import tqdm
 from pathlib import Path
 import torch
 from transformers.modeling_bert import BertForPreTraining, BertLayerNorm, ACT2FN
 from transformers.modeling_auto import AutoModelForQuestionAnswering, AutoModelForTokenClassification, AutoModelForSequenceClassification
-from transformers.configuration_auto import AutoConfig
 
 from torch import nn
 from torch.nn import CrossEntropyLoss, MSELoss, BCEWithLogitsLoss
@@ -689,12 +684,19 @@ class TokenClassificationHead(PredictionHead):
 
 
 class BertLMHead(PredictionHead):
-    def __init__(self, hidden_size, vocab_size, hidden_act="gelu", task_name="lm", **kwargs):
+    def __init__(self, hidden_size, vocab_size, hidden_act="gelu", task_name="lm", pad_vocab_to_multiple_of=None,
+                 **kwargs):
+        """
+        :param pad_vocab_to_multiple_of: (Optional) Must be the same as supplied to LanguageModel.load() if the
+                                         embeddings of the LM (i.e. the shared decoder weights) are padded.
+        :type pad_vocab_to_multiple_of: int
+        """
         super(BertLMHead, self).__init__()
 
         self.hidden_size = hidden_size
         self.hidden_act = hidden_act
         self.vocab_size = vocab_size
+        self.pad_vocab_to_multiple_of = pad_vocab_to_multiple_of
         self.loss_fct = CrossEntropyLoss(reduction="none", ignore_index=-1)
         self.num_labels = vocab_size  # vocab size
         # TODO Check if weight init needed!
@@ -714,13 +716,18 @@ class BertLMHead(PredictionHead):
         # this is the "decoder" in the pytorch-transformers repo
         # The output weights are the same as the input embeddings, but there is
         # an output-only bias for each token.
+        # With padded embeddings, the decoder has extra rows that are never predicted (see forward()).
+        if pad_vocab_to_multiple_of:
+            decoder_size = -(-vocab_size // pad_vocab_to_multiple_of) * pad_vocab_to_multiple_of
+        else:
+            decoder_size = vocab_size
         self.decoder = nn.Linear(hidden_size,
-                                 vocab_size,
+                                 decoder_size,
                                  bias=False)
         self.bias = nn.Parameter(torch.zeros(vocab_size))
 
     @classmethod
-    def load(cls, pretrained_model_name_or_path, n_added_tokens=0):
+    def load(cls, pretrained_model_name_or_path, n_added_tokens=0, pad_vocab_to_multiple_of=None):
         """
         Load a prediction head from a saved FARM or transformers model. `pretrained_model_name_or_path`
         can be one of the following:
@@ -734,6 +741,8 @@ class BertLMHead(PredictionHead):
                                               - bert-base-cased
 
                                               See https://huggingface.co/models for full list
+        :param pad_vocab_to_multiple_of: (Optional) Must be the same as supplied to LanguageModel.load() to pad
+                                         the embeddings that are shared with the decoder of this head.
 
         """
 
@@ -757,7 +766,8 @@ class BertLMHead(PredictionHead):
 
             head = cls(hidden_size=bert_with_lm.config.hidden_size,
                        vocab_size=vocab_size,
-                       hidden_act=bert_with_lm.config.hidden_act)
+                       hidden_act=bert_with_lm.config.hidden_act,
+                       pad_vocab_to_multiple_of=pad_vocab_to_multiple_of)
 
             # load weights
             head.dense.load_state_dict(bert_with_lm.cls.predictions.transform.dense.state_dict())
@@ -785,7 +795,9 @@ class BertLMHead(PredictionHead):
         hidden_states = self.dense(hidden_states)
         hidden_states = self.transform_act_fn(hidden_states)
         hidden_states = self.LayerNorm(hidden_states)
-        lm_logits = self.decoder(hidden_states) + self.bias
+        # The matmul runs on the (possibly padded) decoder. Logits of the padding rows are dropped, so they can
+        # neither be predicted nor affect the loss.
+        lm_logits = self.decoder(hidden_states)[..., :self.vocab_size] + self.bias
         return lm_logits
 
     def logits_to_loss(self, logits, **kwargs):
@@ -0,0 +1,419 @@
+import io
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+import pytest
+import torch
+from torch import nn
+
+from transformers.modeling_bert import BertConfig, BertModel
+from transformers.modeling_distilbert import DistilBertConfig, DistilBertModel
+from transformers.modeling_utils import SequenceSummary
+from transformers.modeling_xlnet import XLNetConfig, XLNetModel
+
+from farm.modeling import language_model
+from farm.modeling.language_model import LanguageModel, Bert, DistilBert, XLNet, _with_forward_cache, _resolve_class
+from farm.modeling.prediction_head import BertLMHead
+
+
+class CountingLM(LanguageModel):
+    """ Minimal LanguageModel that counts how often its (cached) forward pass actually runs."""
+
+    def __init__(self):
+        super(CountingLM, self).__init__()
+        self.embeddings = nn.Embedding(20, 4)
+        self.n_calls = 0
+
+    @_with_forward_cache
+    def forward(self, input_ids, padding_mask, return_pooled=True, **kwargs):
+        self.n_calls += 1
+        self.last_input_shape = tuple(input_ids.shape)
+        sequence_output = self.embeddings(input_ids) * padding_mask.unsqueeze(-1)
+        pooled_output = sequence_output[:, 0] if return_pooled else None
+        if self._emit_hidden:
+            return sequence_output, pooled_output, (sequence_output, sequence_output)
+        return sequence_output, pooled_output
+
+
+def _batch(seed):
+    input_ids = torch.tensor([[1, 2, 3, 0], [4, 5, 0, 0]]) + seed
+    padding_mask = (input_ids != seed).long()
+    return {"input_ids": input_ids, "padding_mask": padding_mask}
+
+
+@pytest.fixture
+def cached_lm():
+    lm = CountingLM()
+    lm.eval()
+    lm.enable_forward_cache(capacity=2)
+    return lm
+
+
+def test_forward_cache_hit_and_miss(cached_lm):
+    with torch.no_grad():
+        sequence_output, pooled_output = cached_lm(**_batch(0))
+        assert cached_lm.n_calls == 1
+        cached_sequence_output, cached_pooled_output = cached_lm(**_batch(0))
+        assert cached_lm.n_calls == 1
+        assert torch.equal(sequence_output, cached_sequence_output)
+        assert torch.equal(pooled_output, cached_pooled_output)
+        cached_lm(**_batch(1))
+        assert cached_lm.n_calls == 2
+
+    # no caching with enabled gradients
+    cached_lm(**_batch(0))
+    assert cached_lm.n_calls == 3
+
+
+def test_forward_cache_returns_copies(cached_lm):
+    with torch.no_grad():
+        sequence_output, _ = cached_lm(**_batch(0))
+        expected = sequence_output.clone()
+        sequence_output.zero_()
+        cached_sequence_output, _ = cached_lm(**_batch(0))
+        assert cached_lm.n_calls == 1
+        assert torch.equal(cached_sequence_output, expected)
+        cached_sequence_output.zero_()
+        assert torch.equal(cached_lm(**_batch(0))[0], expected)
+
+
+def test_forward_cache_evicts_least_recently_used(cached_lm):
+    with torch.no_grad():
+        cached_lm(**_batch(0))
+        cached_lm(**_batch(1))
+        cached_lm(**_batch(0))  # hit, batch 1 is now the least recently used
+        cached_lm(**_batch(2))  # evicts batch 1
+        assert cached_lm.n_calls == 3
+        assert len(cached_lm._forward_cache) == 2
+        cached_lm(**_batch(0))
+        assert cached_lm.n_calls == 3
+        cached_lm(**_batch(1))
+        assert cached_lm.n_calls == 4
+
+
+def test_forward_cache_cleared_on_train(cached_lm):
+    with torch.no_grad():
+        cached_lm(**_batch(0))
+        cached_lm.train()
+        assert len(cached_lm._forward_cache) == 0
+        cached_lm(**_batch(0))
+        assert cached_lm.n_calls == 2
+        cached_lm.eval()
+        cached_lm(**_batch(0))
+        assert cached_lm.n_calls == 3
+
+    cached_lm.disable_forward_cache()
+    with torch.no_grad():
+        cached_lm(**_batch(0))
+    assert cached_lm.n_calls == 4
+
+
+def test_forward_cache_shared_across_threads(cached_lm):
+    # like the replicas of DataParallel, which share the cache of the wrapped model
+    def _run(seed):
+        with torch.no_grad():
+            for i in range(20):
+                cached_lm(**_batch((seed + i) % 5))
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(_run, range(4)))
+    assert len(cached_lm._forward_cache) == 2
+
+
+def test_forward_cache_key_depends_on_output_options(cached_lm):
+    cached_lm.enable_forward_cache(capacity=8)
+    with torch.no_grad():
+        cached_lm(**_batch(0))
+        _, pooled_output = cached_lm(**_batch(0), return_pooled=False)
+        assert cached_lm.n_calls == 2
+        assert pooled_output is None
+
+        cached_lm._emit_hidden = True
+        outputs = cached_lm(**_batch(0))
+        assert cached_lm.n_calls == 3
+        assert len(outputs) == 3
+        cached_lm._emit_hidden = False
+
+        cached_lm._autocast_dtype = torch.bfloat16
+        cached_lm(**_batch(0))
+        assert cached_lm.n_calls == 4
+        cached_lm._autocast_dtype = None
+
+        cached_lm(**_batch(0))
+        assert cached_lm.n_calls == 4
+
+
+def _tiny_bert():
+    bert = Bert()
+    bert.model = BertModel(BertConfig(vocab_size=20, hidden_size=8, num_hidden_layers=2, num_attention_heads=2,
+                                      intermediate_size=16))
+    bert.language = "english"
+    return bert.eval()
+
+
+def _tiny_xlnet():
+    xlnet = XLNet()
+    config = XLNetConfig(vocab_size=20, d_model=8, n_layer=2, n_head=2, d_inner=16)
+    xlnet.model = XLNetModel(config)
+    config.summary_last_dropout = 0
+    xlnet.pooler = SequenceSummary(config)
+    xlnet.language = "english"
+    return xlnet.eval()
+
+
+def _tiny_distilbert():
+    distilbert = DistilBert()
+    config = DistilBertConfig(vocab_size=20, dim=8, n_layers=2, n_heads=2, hidden_dim=16)
+    distilbert.model = DistilBertModel(config)
+    config.summary_last_dropout = 0
+    config.summary_type = "first"
+    config.summary_activation = "tanh"
+    distilbert.pooler = SequenceSummary(config)
+    distilbert.language = "english"
+    return distilbert.eval()
+
+
+def test_distilbert_hidden_states_output():
+    distilbert = _tiny_distilbert()
+    batch = _padded_batch(lengths=[5, 3], max_seq_len=6)
+    with torch.no_grad():
+        distilbert.enable_hidden_states_output()
+        outputs = distilbert(**batch)
+        assert len(outputs) == 3
+        assert len(outputs[2]) == distilbert.model.config.n_layers + 1
+        assert torch.equal(outputs[2][-1], outputs[0])
+
+        distilbert.disable_hidden_states_output()
+        assert len(distilbert(**batch)) == 2
+
+
+def _padded_batch(lengths, max_seq_len, pad_left=False):
+    padding_mask = torch.zeros(len(lengths), max_seq_len, dtype=torch.long)
+    for i, length in enumerate(lengths):
+        if pad_left:
+            padding_mask[i, max_seq_len - length:] = 1
+        else:
+            padding_mask[i, :length] = 1
+    input_ids = torch.randint(1, 20, (len(lengths), max_seq_len)) * padding_mask
+    return {"input_ids": input_ids, "segment_ids": torch.zeros_like(input_ids), "padding_mask": padding_mask}
+
+
+@pytest.mark.parametrize("lm_fn, pad_left", [(_tiny_bert, False), (_tiny_xlnet, True)])
+def test_forward_trimmed_matches_forward(lm_fn, pad_left):
+    torch.manual_seed(42)
+    lm = lm_fn()
+    batch = _padded_batch(lengths=[5, 3], max_seq_len=8, pad_left=pad_left)
+    used = batch["padding_mask"].unsqueeze(-1).bool()
+    with torch.no_grad():
+        sequence_output, pooled_output = lm(**batch)
+        trimmed_sequence_output, trimmed_pooled_output = lm.forward_trimmed(**batch)
+
+    assert trimmed_sequence_output.shape == sequence_output.shape
+    assert torch.allclose(trimmed_sequence_output.masked_select(used), sequence_output.masked_select(used), atol=1e-5)
+    assert torch.allclose(trimmed_pooled_output, pooled_output, atol=1e-5)
+    # columns that are padding for the whole batch are filled with zeros
+    unused_columns = batch["padding_mask"].sum(dim=0) == 0
+    assert (trimmed_sequence_output[:, unused_columns] == 0).all()
+
+
+def test_forward_trimmed_pads_back_hidden_states():
+    torch.manual_seed(42)
+    lm = _tiny_bert()
+    lm.enable_hidden_states_output()
+    batch = _padded_batch(lengths=[5, 3], max_seq_len=8)
+    used = batch["padding_mask"].unsqueeze(-1).bool()
+    with torch.no_grad():
+        _, _, all_hidden_states = lm(**batch)
+        _, _, trimmed_all_hidden_states = lm.forward_trimmed(**batch)
+
+    assert len(trimmed_all_hidden_states) == len(all_hidden_states)
+    for trimmed_hidden_states, hidden_states in zip(trimmed_all_hidden_states, all_hidden_states):
+        assert trimmed_hidden_states.shape == hidden_states.shape
+        assert torch.allclose(trimmed_hidden_states.masked_select(used), hidden_states.masked_select(used), atol=1e-5)
+        assert (trimmed_hidden_states[:, 5:] == 0).all()
+
+
+@pytest.mark.parametrize("lengths, expected_seq_len", [([0, 0], 6), ([6, 2], 6), ([4, 2], 4)])
+def test_forward_trimmed_input_length(lengths, expected_seq_len):
+    lm = CountingLM().eval()
+    batch = _padded_batch(lengths=lengths, max_seq_len=6)
+    with torch.no_grad():
+        sequence_output, _ = lm.forward_trimmed(**batch)
+    assert lm.last_input_shape == (2, expected_seq_len)
+    assert sequence_output.shape == (2, 6, 4)
+
+
+def test_forward_trimmed_not_used_while_tracing():
+    lm = CountingLM().eval()
+    batch = _padded_batch(lengths=[4, 2], max_seq_len=6)
+    with torch.no_grad():
+        torch.jit.trace(lambda input_ids, segment_ids, padding_mask: lm.forward_trimmed(
+            input_ids=input_ids, segment_ids=segment_ids, padding_mask=padding_mask),
+            (batch["input_ids"], batch["segment_ids"], batch["padding_mask"]), check_trace=False)
+    assert lm.last_input_shape == (2, 6)
+
+
+def test_padding_trimming_switch():
+    lm = CountingLM()
+    assert not lm.trims_padding
+    lm.enable_padding_trimming()
+    assert lm.trims_padding
+    lm.disable_padding_trimming()
+    assert not lm.trims_padding
+
+
+def _pool_tokens_reference(sequence_output, padding_mask, strategy, ignore_first_token):
+    # pooling via numpy masked arrays, as done before pooling with torch ops
+    token_vecs = sequence_output.numpy()
+    ignore_mask_2d = padding_mask.numpy() == 0
+    if ignore_first_token:
+        ignore_mask_2d[:, 0] = True
+    ignore_mask_3d = np.zeros(token_vecs.shape, dtype=bool)
+    ignore_mask_3d[:, :, :] = ignore_mask_2d[:, :, np.newaxis]
+    if strategy == "reduce_max":
+        return np.ma.array(data=token_vecs, mask=ignore_mask_3d).max(axis=1).data
+    if strategy == "reduce_mean":
+        return np.ma.array(data=token_vecs, mask=ignore_mask_3d).mean(axis=1).data
+
+
+@pytest.mark.parametrize("strategy", ["reduce_mean", "reduce_max"])
+@pytest.mark.parametrize("ignore_first_token", [True, False])
+def test_pool_tokens(strategy, ignore_first_token):
+    torch.manual_seed(42)
+    lm = CountingLM()
+    sequence_output = torch.randn(3, 5, 4)
+    # the last sequence has no token left to pool if the first token is ignored
+    padding_mask = torch.tensor([[1, 1, 1, 0, 0], [1, 1, 1, 1, 1], [1, 0, 0, 0, 0]])
+    original_padding_mask = padding_mask.clone()
+
+    pooled_vecs = lm._pool_tokens(sequence_output, padding_mask, strategy, ignore_first_token=ignore_first_token)
+    expected = _pool_tokens_reference(sequence_output, padding_mask, strategy, ignore_first_token)
+
+    assert torch.equal(padding_mask, original_padding_mask)
+    assert pooled_vecs.shape == (3, 4)
+    if ignore_first_token:
+        np.testing.assert_allclose(pooled_vecs[:2], expected[:2], rtol=1e-5, atol=1e-6)
+        np.testing.assert_array_equal(pooled_vecs[2], np.zeros(4))
+    else:
+        np.testing.assert_allclose(pooled_vecs, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_lm_head_with_padded_vocab():
+    torch.manual_seed(42)
+    head = BertLMHead(hidden_size=8, vocab_size=21, pad_vocab_to_multiple_of=8)
+    assert head.decoder.weight.shape == (24, 8)
+
+    embeddings = nn.Embedding(24, 8)
+    head.set_shared_weights(embeddings.weight)
+    hidden_states = torch.randn(2, 3, 8)
+    logits = head(hidden_states)
+    assert logits.shape == (2, 3, 21)
+    unpadded_head = BertLMHead(hidden_size=8, vocab_size=21)
+    unpadded_head.load_state_dict({name: param[:21] if name == "decoder.weight" else param
+                                   for name, param in head.state_dict().items()})
+    assert torch.allclose(logits, unpadded_head(hidden_states), atol=1e-6)
+
+    # the padding is restored from the config, so that saved heads can be loaded again
+    loaded_head = BertLMHead(**head.config)
+    loaded_head.load_state_dict(head.state_dict())
+    assert loaded_head.decoder.weight.shape == (24, 8)
+
+
+@pytest.mark.parametrize("name, expected_class", [
+    ("distilbert-base-german-cased", "DistilBert"),
+    ("albert-base-v2", "Albert"),
+    ("xlm-roberta-base", "XLMRoberta"),
+    ("saved_models/xlm_roberta", "XLMRoberta"),
+    ("roberta-base", "Roberta"),
+    ("/home/Albert/models/bert-base-cased", "Bert"),
+    ("/data/BERT/xlnet-base-cased", "XLNet"),
+    ("bert-base-german-cased", "Bert"),
+    ("xlnet-base-cased", "XLNet"),
+    ("gpt2", None),
+])
+def test_resolve_class(name, expected_class):
+    assert _resolve_class(name) == expected_class
+
+
+@pytest.mark.parametrize("name, expected_language", [
+    ("bert-base-german-cased", "german"),
+    ("/models/English/bert-base-german-cased", "german"),
+    ("bert-base-multilingual-cased", "multilingual"),
+    ("bert-base-cased", "english"),
+])
+def test_infer_language_from_name(name, expected_language):
+    assert LanguageModel._infer_language_from_name(name) == expected_language
+
+
+def test_infer_language_from_name_multiple_matches():
+    with pytest.raises(ValueError):
+        LanguageModel._infer_language_from_name("/models/english/bert-base-german-cased")
+
+
+def _record_reads(monkeypatch):
+    """ Let the prefetch helpers open files that record the (offset, n_bytes) of each read."""
+    reads = []
+
+    class _RecordingFileIO(io.FileIO):
+        def readinto(self, buffer):
+            offset = self.tell()
+            n_read = super().readinto(buffer)
+            reads.append((offset, n_read))
+            return n_read
+
+    monkeypatch.setattr(language_model, "open", lambda path, mode, buffering: _RecordingFileIO(path, "r"),
+                        raising=False)
+    return reads
+
+
+def test_prefetch_file_empty(tmp_path, monkeypatch):
+    reads = _record_reads(monkeypatch)
+    path = tmp_path / "language_model.bin"
+    path.write_bytes(b"")
+    language_model._prefetch_file(path)
+    assert reads == []
+
+
+@pytest.mark.parametrize("size", [1, 1001, 4096])
+def test_prefetch_file_reads_every_byte(tmp_path, monkeypatch, size):
+    reads = _record_reads(monkeypatch)
+    path = tmp_path / "language_model.bin"
+    path.write_bytes(bytes(size))
+    language_model._prefetch_file(path, n_threads=4, block_size=64)
+    # the ranges read by all threads cover the file without gaps or overlaps
+    position = 0
+    for offset, n_read in sorted(reads):
+        assert offset == position
+        position += n_read
+    assert position == size
+
+
+def test_fadvise_willneed_skips_missing_and_remote_paths(tmp_path, monkeypatch):
+    prefetched = []
+    monkeypatch.setattr(language_model, "_prefetch_file", prefetched.append)
+    monkeypatch.delattr(language_model.os, "posix_fadvise", raising=False)
+    language_model._fadvise_willneed(tmp_path / "missing" / "language_model.bin")
+    language_model._fadvise_willneed("bert-base-cased")
+    assert prefetched == []
+
+    # without posix_fadvise, local files are read via _prefetch_file
+    path = tmp_path / "language_model.bin"
+    path.write_bytes(bytes(10))
+    language_model._fadvise_willneed(path)
+    assert prefetched == [path]
+
+
+def test_prefetch_returns_one_future_per_path(tmp_path):
+    paths = []
+    for i in range(3):
+        model_dir = tmp_path / f"model_{i}"
+        model_dir.mkdir()
+        (model_dir / "language_model.bin").write_bytes(bytes(100 * i))
+        paths.append(model_dir)
+    paths += [tmp_path / "missing", "bert-base-cased"]
+
+    futures = LanguageModel.prefetch(paths, n_threads=2)
+    assert len(futures) == len(paths)
+    done, not_done = wait(futures, timeout=10)
+    assert len(done) == len(paths) and not not_done
+    assert all(future.exception() is None for future in futures)